@@ -0,0 +1,55 @@
+/**
+ * ═══════════════════════════════════════════════════════════════════════
+ * MODAL CLIP EMBEDDING DECODER
+ * ═══════════════════════════════════════════════════════════════════════
+ *
+ * The Modal CLIP service returns embeddings as base64-encoded little-endian
+ * float16 buffers instead of JSON float arrays:
+ *
+ *   { "embedding_b64": "...", "dtype": "float16", "dims": [N, 768] }
+ *
+ * This halves the payload and avoids boxing every float on the server.
+ */
+
+// IEEE 754 half precision -> JS number
+function halfToFloat(h) {
+  const sign = h & 0x8000 ? -1 : 1;
+  const exponent = (h >> 10) & 0x1f;
+  const fraction = h & 0x03ff;
+
+  if (exponent === 0) return sign * Math.pow(2, -14) * (fraction / 1024);
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+/**
+ * Decode a Modal CLIP response into rows of numbers.
+ * Returns an array of embeddings (one per row of `dims`).
+ */
+export function decodeClipEmbeddings(data) {
+  if (data.dtype !== "float16" || !data.embedding_b64 || !data.dims) {
+    throw new Error("Unsupported CLIP embedding payload");
+  }
+
+  const bytes = Buffer.from(data.embedding_b64, "base64");
+  const width = data.dims[data.dims.length - 1];
+  const count = bytes.length / 2 / width;
+  const rows = [];
+
+  for (let row = 0; row < count; row++) {
+    const embedding = new Array(width);
+    for (let i = 0; i < width; i++) {
+      embedding[i] = halfToFloat(bytes.readUInt16LE((row * width + i) * 2));
+    }
+    rows.push(embedding);
+  }
+
+  return rows;
+}
+
+/**
+ * Decode a single-embedding Modal CLIP response.
+ */
+export function decodeClipEmbedding(data) {
+  return decodeClipEmbeddings(data)[0];
+}
@@ -0,0 +1,146 @@
+"""
+═══════════════════════════════════════════════════════════════════════
+FASHION-CLIP VISION ENCODER -> TENSORRT INT8 ENGINE
+═══════════════════════════════════════════════════════════════════════
+
+Exports the Fashion-CLIP vision tower to ONNX and builds an INT8 TensorRT
+engine calibrated on representative product images.
+
+Engines are tied to the GPU architecture, so run this on the same GPU type
+as the RunPod workers and store the engine where TRT_ENGINE_PATH points
+(e.g. a network volume):
+
+  python3 build_trt_engine.py --calib-dir /workspace/calib_images \
+      --engine /runpod-volume/fashion_clip_vision_int8.trt
+
+The handler picks the engine up at startup; without it, it falls back to
+torch.compile.
+"""
+
+import argparse
+import copy
+import os
+from typing import List
+
+import torch
+import tensorrt as trt
+
+# Loads Fashion-CLIP and the preprocessing used at request time
+import handler
+from handler import model, open_image, preprocess_image, IMAGE_SIZE, IMAGE_MEAN, IMAGE_STD, PIPELINE_CHUNK_SIZE
+import torchvision.transforms.v2.functional as TF
+
+CALIBRATION_IMAGES = 512
+CALIBRATION_CACHE = "fashion_clip_vision_int8.calib"
+
+
+class VisionEncoder(torch.nn.Module):
+    """get_image_features as a plain module for ONNX export"""
+
+    def __init__(self, clip_model):
+        super().__init__()
+        self.clip_model = clip_model
+
+    def forward(self, pixel_values):
+        return self.clip_model.get_image_features(pixel_values=pixel_values)
+
+
+class ImageCalibrator(trt.IInt8EntropyCalibrator2):
+    """Feeds preprocessed product images to TensorRT's INT8 calibration"""
+
+    def __init__(self, image_paths: List[str], cache_path: str):
+        super().__init__()
+        self.image_paths = image_paths
+        self.cache_path = cache_path
+        self.position = 0
+        self.batch = None
+
+    def get_batch_size(self):
+        return PIPELINE_CHUNK_SIZE
+
+    def get_batch(self, names):
+        if self.position + PIPELINE_CHUNK_SIZE > len(self.image_paths):
+            return None
+
+        paths = self.image_paths[self.position:self.position + PIPELINE_CHUNK_SIZE]
+        self.position += PIPELINE_CHUNK_SIZE
+
+        images = []
+        for path in paths:
+            with open(path, "rb") as f:
+                image = open_image(f.read())
+            if image is None:
+                image = torch.zeros((3, IMAGE_SIZE, IMAGE_SIZE), dtype=torch.uint8)
+            images.append(preprocess_image(image.to(handler.device)))
+
+        # Keep a reference so the device buffer outlives this call
+        self.batch = TF.normalize(torch.stack(images), IMAGE_MEAN, IMAGE_STD).float().contiguous()
+        return [int(self.batch.data_ptr())]
+
+    def read_calibration_cache(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "rb") as f:
+                return f.read()
+        return None
+
+    def write_calibration_cache(self, cache):
+        with open(self.cache_path, "wb") as f:
+            f.write(cache)
+
+
+def export_onnx(onnx_path: str):
+    """Export the vision tower in FP32 with a static PIPELINE_CHUNK_SIZE batch"""
+    encoder = VisionEncoder(copy.deepcopy(model).float().cpu().eval())
+
+    torch.onnx.export(
+        encoder,
+        torch.zeros(PIPELINE_CHUNK_SIZE, 3, IMAGE_SIZE, IMAGE_SIZE),
+        onnx_path,
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        opset_version=17,
+    )
+    print(f"✅ Exported ONNX vision encoder to {onnx_path}")
+
+
+def build_engine(onnx_path: str, engine_path: str, calib_dir: str):
+    """Build an INT8 (with FP16 fallback) engine calibrated on calib_dir"""
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+
+    with open(onnx_path, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError(f"Failed to parse ONNX: {errors}")
+
+    image_paths = sorted(
+        os.path.join(calib_dir, name) for name in os.listdir(calib_dir)
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    )[:CALIBRATION_IMAGES]
+    print(f"📊 Calibrating on {len(image_paths)} images from {calib_dir}")
+
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.INT8)
+    config.set_flag(trt.BuilderFlag.FP16)
+    config.int8_calibrator = ImageCalibrator(image_paths, CALIBRATION_CACHE)
+
+    engine = builder.build_serialized_network(network, config)
+    if engine is None:
+        raise RuntimeError("TensorRT engine build failed")
+
+    with open(engine_path, "wb") as f:
+        f.write(engine)
+    print(f"✅ Saved INT8 engine to {engine_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an INT8 TensorRT engine for the Fashion-CLIP vision tower")
+    parser.add_argument("--calib-dir", required=True, help="Directory of representative product images")
+    parser.add_argument("--engine", default=handler.TRT_ENGINE_PATH, help="Output engine path")
+    parser.add_argument("--onnx", default="fashion_clip_vision.onnx", help="Intermediate ONNX path")
+    args = parser.parse_args()
+
+    export_onnx(args.onnx)
+    build_engine(args.onnx, args.engine, args.calib_dir)
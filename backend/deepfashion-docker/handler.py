@@ -19,10 +19,19 @@ Updated: January 2025
 
 import runpod
 import io
-import base64
-from typing import Dict, Any, List, Optional
+import os
+import logging
+import contextlib
+import queue
+import threading
+import pybase64
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from PIL import Image
 import torch
+import torchvision.transforms.v2.functional as TF
+from torchvision.io import decode_jpeg, ImageReadMode
+from torchvision.transforms import InterpolationMode
 import numpy as np
 from transformers import CLIPProcessor, CLIPModel
 import time
@@ -31,7 +40,37 @@ import time
 # CONFIGURATION
 # ============================================================================
 
+# Per-request logging goes through logging (DEBUG for progress); LOG_LEVEL=WARNING silences the summary line
+# Case-insensitive; an unknown name falls back to INFO instead of failing the worker at import
+LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
+logging.basicConfig(
+    level=LOG_LEVEL if isinstance(LOG_LEVEL, int) else logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Full tracebacks on handler errors only when debugging (expensive under high error rates)
+DEBUG_TRACEBACKS = os.environ.get("DEBUG_TRACEBACKS", "0") == "1"
+
 BATCH_SIZE = 16  # Reduced to avoid 400 errors
+
+# base64 + PIL decoders release the GIL, so images decode in parallel
+DECODE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Images per pipeline stage: chunk k+1 decodes/uploads while chunk k runs on the GPU
+PIPELINE_CHUNK_SIZE = 8
+
+# Optional INT8 TensorRT engine for the vision tower (built by build_trt_engine.py)
+TRT_ENGINE_PATH = os.environ.get("TRT_ENGINE_PATH", "/runpod-volume/fashion_clip_vision_int8.trt")
+
+# Concurrent vision-encoder replicas per GPU, each running whole chunks on its own CUDA stream
+# Defaults to 1 so the vision encoder keeps its reduce-overhead CUDA graphs; raise it only after
+# measuring that concurrent same-weight streams beat one graphed stream on the target GPU
+VISION_REPLICAS = int(os.environ.get("VISION_REPLICAS", "1"))
+REPLICA_POOL = ThreadPoolExecutor(max_workers=VISION_REPLICAS)
+
+# Base64 of the JPEG start-of-image marker (FF D8 FF), so JPEGs are spotted before decoding
+JPEG_B64_PREFIX = "/9j/"
 MODEL_NAME = "patrickjohncyh/fashion-clip"
 
 # Attribute vocabularies
@@ -54,10 +93,10 @@ LENGTH_LABELS = ['mini', 'knee', 'midi', 'maxi', 'ankle']
 # ✅ NEW: Gender labels
 GENDER_LABELS = ['men', 'women', 'boys', 'girls', 'unisex']
 
-# Categories that have sleeves
-SLEEVE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'hoodie', 'jacket', 'coat']
-NECKLINE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater']
-LENGTH_CATEGORIES = ['dress', 'skirt']
+# Categories that have sleeves (sets: checked once per image per conditional attribute)
+SLEEVE_CATEGORIES = frozenset(['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'hoodie', 'jacket', 'coat'])
+NECKLINE_CATEGORIES = frozenset(['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater'])
+LENGTH_CATEGORIES = frozenset(['dress', 'skirt'])
 
 # ============================================================================
 # GLOBAL MODEL LOADING (happens once per container)
@@ -78,136 +117,489 @@ if device == "cuda":
     model = model.half()  # Use FP16 for faster inference on RTX 4090
     torch.backends.cudnn.benchmark = True
 
+# Free (stream, vision encoder) replicas; warmup() swaps in TensorRT or torch.compile'd encoders on GPU.
+# Replicas share the weights and interleave chunks on the SMs from separate CUDA streams
+replicas = queue.Queue()
+for _ in range(VISION_REPLICAS):
+    replicas.put((torch.cuda.Stream() if device == "cuda" else None, model.get_image_features))
+# Batch sizes the encoders were captured for (TensorRT engine / CUDA graphs); empty = any shape
+VISION_STATIC_BATCHES = ()
+# True when the encoders replay CUDA graphs, which must stay on the pool threads that recorded them
+VISION_CUDA_GRAPHS = False
+
+# nvJPEG decode on the GPU (torchvision.io); PNG/WebP and nvJPEG failures go through PIL
+GPU_JPEG_DECODE = device == "cuda"
+
+# CLIP preprocessing constants, applied on the device in preprocess_image
+IMAGE_SIZE = processor.image_processor.crop_size["height"]
+IMAGE_MEAN = processor.image_processor.image_mean
+IMAGE_STD = processor.image_processor.image_std
+
 load_time = time.time() - start_time
 print(f"✅ Model loaded on {device} in {load_time:.2f}s")
 print(f"📊 GPU: {torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'CPU'}")
 
+# ============================================================================
+# TEXT EMBEDDING CACHE (label prompts are fixed, so encode them once)
+# ============================================================================
+
+def encode_text_prompts(text_prompts: List[str]) -> torch.Tensor:
+    """Encode prompts to normalized text embeddings, pre-multiplied by the CLIP logit scale"""
+    text_inputs = processor.tokenizer(
+        text_prompts,
+        return_tensors="pt",
+        padding=True
+    ).to(device)
+    
+    with torch.inference_mode():
+        text_embeds = model.get_text_features(**text_inputs)
+        text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+        # Folding the scale in here leaves a bare matmul per attribute at request time
+        return model.logit_scale.exp() * text_embeds
+
+
+CATEGORY_TEXT_EMBEDS = encode_text_prompts([f"a photo of a {category}" for category in CATEGORY_LABELS])
+COLOR_TEXT_EMBEDS = encode_text_prompts([f"{color} clothing" for color in COLOR_LABELS])
+PATTERN_TEXT_EMBEDS = encode_text_prompts([f"{pattern} pattern clothing" for pattern in PATTERN_LABELS])
+GENDER_TEXT_EMBEDS = encode_text_prompts([f"{gender} clothing" for gender in GENDER_LABELS])
+SLEEVE_TEXT_EMBEDS = encode_text_prompts([f"{label} sleeve clothing" for label in SLEEVE_LENGTH_LABELS])
+NECKLINE_TEXT_EMBEDS = encode_text_prompts([f"{label} neckline" for label in NECKLINE_LABELS])
+LENGTH_TEXT_EMBEDS = encode_text_prompts([f"{label} length dress" for label in LENGTH_LABELS])
+
+print(f"✅ Label text embeddings cached in {time.time() - start_time - load_time:.2f}s")
+
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
-def decode_image(image_data: str) -> Optional[Image.Image]:
-    """Decode base64 image data to PIL Image"""
+def decode_base64(image_data: str, writable: bool = False):
+    """Decode base64 image data to encoded image bytes (a bytearray when writable)"""
+    try:
+        # SIMD base64 decode (AVX2/AVX-512/NEON, picked at runtime)
+        if writable:
+            return pybase64.b64decode_as_bytearray(image_data, validate=False)
+        return pybase64.b64decode(image_data, validate=False)
+    except Exception as e:
+        logger.warning("❌ Failed to decode base64: %s", e)
+        return None
+
+
+def open_image(image_bytes) -> Optional[torch.Tensor]:
+    """Decode encoded image bytes on CPU with PIL to a uint8 RGB CHW tensor"""
     try:
-        image_bytes = base64.b64decode(image_data)
+        # BytesIO shares an immutable bytes buffer instead of copying it
         image = Image.open(io.BytesIO(image_bytes))
         
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        return image
+        return TF.pil_to_tensor(image)
     except Exception as e:
-        print(f"❌ Failed to decode image: {str(e)}")
+        logger.warning("❌ Failed to decode image: %s", e)
         return None
 
 
-def batch_classify(images: List[Image.Image], text_prompts: List[str], labels: List[str]) -> List[Dict[str, Any]]:
+def decode_item(indexed_item):
     """
-    Classify multiple images against text prompts in a single batch
-    Returns list of {label, confidence} for each image
-    
-    Args:
-        images: List of PIL images
-        text_prompts: List of text prompts (e.g., "black clothing", "striped pattern")
-        labels: List of actual labels corresponding to prompts (e.g., "black", "striped")
+    Decode one request item, returning (index, image_id, image or None)
+    JPEGs bound for the GPU stay encoded (as a uint8 byte tensor) for nvJPEG;
+    everything else is decoded here with PIL
     """
+    i, item = indexed_item
+    image_id = item.get("id", f"image_{i}")
+    image_data = item.get("data")
+    
+    # "data:image/jpeg;base64,...": one C-level scan for the comma
+    if isinstance(image_data, str) and image_data.startswith("data:"):
+        image_data = image_data.partition(",")[2]
+    
+    if GPU_JPEG_DECODE and isinstance(image_data, str) and image_data.startswith(JPEG_B64_PREFIX):
+        # Decode straight into a bytearray that torch.frombuffer can wrap without a copy
+        image_bytes = decode_base64(image_data, writable=True)
+        if image_bytes is None:
+            return i, image_id, None
+        return i, image_id, torch.frombuffer(image_bytes, dtype=torch.uint8)
+    
+    image_bytes = decode_base64(image_data)
+    
+    if image_bytes is None:
+        return i, image_id, None
+    
+    return i, image_id, open_image(image_bytes)
+
+
+def to_device_image(image: torch.Tensor) -> Optional[torch.Tensor]:
+    """Turn a decode_item output into a uint8 RGB CHW tensor on the device"""
+    if image.dim() == 3:
+        if device == "cuda":
+            # uint8 upload is 4x smaller than the float32 pixel values
+            return image.pin_memory().to(device, non_blocking=True)
+        return image
+    
     try:
-        # Prepare inputs
-        inputs = processor(
-            text=text_prompts,
-            images=images,
-            return_tensors="pt",
-            padding=True
-        ).to(device)
+        return decode_jpeg(image, mode=ImageReadMode.RGB, device=device)
+    except Exception:
+        # CMYK/progressive edge cases nvJPEG rejects: fall back to PIL
+        image = open_image(image.numpy().tobytes())
+        return to_device_image(image) if image is not None else None
+
+
+def preprocess_image(image: torch.Tensor) -> torch.Tensor:
+    """CLIP preprocessing on the device: shortest-side bicubic resize + center crop, scaled to [0, 1]"""
+    # Resize the uint8 pixels (bicubic overshoot is clamped back to 0..255, as in CLIPImageProcessor), then scale
+    image = TF.resize(image, [IMAGE_SIZE], interpolation=InterpolationMode.BICUBIC, antialias=True)
+    image = TF.center_crop(image, [IMAGE_SIZE])
+    return TF.to_dtype(image, torch.float32, scale=True)
+
+
+def prepare_chunk(indexed_items, upload_stream) -> tuple:
+    """
+    Decode a chunk of request items and stage its pixel values on the device
+    Returns (decoded, pixel_values or None, ready_event or None), where decoded
+    holds (index, image_id, ok) so full-resolution frames are freed right away
+    """
+    if len(indexed_items) == 1:
+        decoded = [decode_item(indexed_items[0])]
+    else:
+        decoded = list(DECODE_POOL.map(decode_item, indexed_items))
+    
+    # Decode/upload/resize on the side stream: overlaps the previous chunk's forward
+    with torch.cuda.stream(upload_stream) if upload_stream is not None else contextlib.nullcontext():
+        for n, (i, image_id, image) in enumerate(decoded):
+            if image is not None:
+                decoded[n] = (i, image_id, to_device_image(image))
+        
+        images = [image for _, _, image in decoded if image is not None]
+        decoded = [(i, image_id, image is not None) for i, image_id, image in decoded]
+        
+        if not images:
+            return decoded, None, None
+        
+        pixel_values = torch.stack([preprocess_image(image) for image in images])
+        pixel_values = TF.normalize(pixel_values, IMAGE_MEAN, IMAGE_STD).to(model.dtype)
         
-        # Run inference
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)
+        if upload_stream is None:
+            return decoded, pixel_values, None
+        
+        ready_event = torch.cuda.Event()
+        ready_event.record(upload_stream)
+    
+    return decoded, pixel_values, ready_event
+
+
+def iter_prepared_chunks(image_items: List[Dict[str, Any]]):
+    """
+    Two-stage pipeline: a producer thread decodes and uploads chunk k+1
+    while the caller runs the model on chunk k
+    Yields (decoded, pixel_values, ready_event) per chunk, in input order
+    """
+    pipeline = queue.Queue(maxsize=2)
+    indexed_items = list(enumerate(image_items))
+    
+    def produce():
+        try:
+            upload_stream = torch.cuda.Stream() if device == "cuda" else None
+            for start in range(0, len(indexed_items), PIPELINE_CHUNK_SIZE):
+                pipeline.put(prepare_chunk(indexed_items[start:start + PIPELINE_CHUNK_SIZE], upload_stream))
+        except Exception as e:
+            pipeline.put(e)
+        finally:
+            pipeline.put(None)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    
+    try:
+        while True:
+            chunk = pipeline.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Unblock the producer if the consumer stopped early
+        while producer.is_alive():
+            try:
+                pipeline.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def encode_images(pixel_values: torch.Tensor, encoder=None) -> torch.Tensor:
+    """Run the vision encoder once and return L2-normalized image embeddings"""
+    encoder = encoder or model.get_image_features
+    n = len(pixel_values)
+    
+    with torch.inference_mode():
+        # Static-shape encoders: pad up to the smallest captured batch that fits
+        if VISION_STATIC_BATCHES:
+            bucket = next(size for size in VISION_STATIC_BATCHES if size >= n)
+            if bucket > n:
+                padding = pixel_values.new_zeros((bucket - n, *pixel_values.shape[1:]))
+                pixel_values = torch.cat([pixel_values, padding])
         
-        # Extract results for each image
-        results = []
-        for i in range(len(images)):
-            top_idx = probs[i].argmax().item()
-            confidence = probs[i][top_idx].item()
+        image_embeds = encoder(pixel_values=pixel_values)[:n]
+        return image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+
+
+def load_trt_engine(engine_path: str):
+    """Deserialize the INT8 TensorRT vision engine"""
+    import tensorrt as trt
+    
+    runtime = trt.Runtime(trt.Logger(trt.Logger.WARNING))
+    with open(engine_path, "rb") as f:
+        return runtime.deserialize_cuda_engine(f.read())
+
+
+def trt_vision_encoder(engine):
+    """Create a TensorRT execution context (one per replica), returning a drop-in for get_image_features"""
+    context = engine.create_execution_context()
+    output = torch.empty(tuple(engine.get_tensor_shape("image_embeds")), device=device, dtype=torch.float32)
+    context.set_tensor_address("image_embeds", output.data_ptr())
+    
+    def encode(pixel_values: torch.Tensor) -> torch.Tensor:
+        pixel_values = pixel_values.float().contiguous()
+        context.set_tensor_address("pixel_values", pixel_values.data_ptr())
+        # Enqueue on the replica's stream so it orders with the surrounding torch ops
+        context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+        return output.to(model.dtype)
+    
+    return encode
+
+
+def warm_replica(stream, encoder, runs: int, batch_sizes: Tuple[int, ...]):
+    """Run dummy batches of each size through one replica on its own stream"""
+    with torch.cuda.stream(stream):
+        for size in batch_sizes:
+            dummy = torch.zeros((size, 3, IMAGE_SIZE, IMAGE_SIZE), device=device, dtype=model.dtype)
+            for _ in range(runs):
+                encode_images(dummy, encoder)
+    torch.cuda.synchronize()
+
+
+def warmup():
+    """Load the TensorRT engine or compile the vision encoder, and warm every replica before the first request"""
+    global VISION_STATIC_BATCHES, VISION_CUDA_GRAPHS
+    
+    if device != "cuda":
+        return
+    
+    warmup_start = time.time()
+    streams = [replicas.get()[0] for _ in range(VISION_REPLICAS)]
+    encoders = None
+    
+    if os.path.exists(TRT_ENGINE_PATH):
+        try:
+            engine = load_trt_engine(TRT_ENGINE_PATH)
+            # The engine is built for a fixed PIPELINE_CHUNK_SIZE batch; one from other settings can't be padded to
+            expected_shape = (PIPELINE_CHUNK_SIZE, 3, IMAGE_SIZE, IMAGE_SIZE)
+            engine_shape = tuple(engine.get_tensor_shape("pixel_values"))
+            if engine_shape != expected_shape:
+                raise ValueError(f"engine input shape {engine_shape} != expected {expected_shape}")
+            encoders = [trt_vision_encoder(engine) for _ in streams]
+            VISION_STATIC_BATCHES = (PIPELINE_CHUNK_SIZE,)
+            for stream, encoder in zip(streams, encoders):
+                REPLICA_POOL.submit(warm_replica, stream, encoder, 1, VISION_STATIC_BATCHES).result()
+            
+            print(f"✅ INT8 TensorRT vision encoder loaded x{VISION_REPLICAS} in {time.time() - warmup_start:.2f}s")
+        except Exception as e:
+            print(f"⚠️ TensorRT engine unusable, falling back to torch.compile: {str(e)}")
+            encoders = None
+            VISION_STATIC_BATCHES = ()
+    
+    if encoders is None:
+        try:
+            # CUDA graphs are tied to the capturing thread, so they are only used with a single replica
+            if VISION_REPLICAS == 1:
+                mode = "reduce-overhead"
+                compiled = torch.compile(model.get_image_features, mode=mode, fullgraph=True, dynamic=False)
+                # One graph for the single-image path, one for full chunks (short chunks pad up to it)
+                VISION_STATIC_BATCHES = (1, PIPELINE_CHUNK_SIZE)
+                VISION_CUDA_GRAPHS = True
+            else:
+                mode = "default"
+                compiled = torch.compile(model.get_image_features, mode=mode, fullgraph=True, dynamic=True)
             
-            results.append({
-                'label': labels[top_idx],  # Use the actual label from labels list
-                'confidence': float(confidence)
-            })
+            # First call compiles, later calls record and replay the CUDA graph (in the pool thread that serves requests)
+            for stream in streams:
+                REPLICA_POOL.submit(
+                    warm_replica, stream, compiled, 3, VISION_STATIC_BATCHES or (1, PIPELINE_CHUNK_SIZE)
+                ).result()
+            encoders = [compiled] * len(streams)
+            
+            print(f"✅ Vision encoder compiled ({mode}) in {time.time() - warmup_start:.2f}s")
+        except Exception as e:
+            print(f"⚠️ torch.compile failed, using eager vision encoder: {str(e)}")
+            encoders = [model.get_image_features] * len(streams)
+            VISION_STATIC_BATCHES = ()
+            VISION_CUDA_GRAPHS = False
+    
+    for stream, encoder in zip(streams, encoders):
+        replicas.put((stream, encoder))
+
+
+def batch_classify(image_embeds: torch.Tensor, text_embeds: torch.Tensor, labels: List[str]) -> Tuple[List[str], List[float]]:
+    """
+    Classify multiple images against cached text embeddings in a single batch
+    Returns (labels, confidences), one entry per image
+    
+    Args:
+        image_embeds: Normalized image embeddings from encode_images
+        text_embeds: Cached prompt embeddings from encode_text_prompts (e.g., COLOR_TEXT_EMBEDS)
+        labels: List of actual labels corresponding to prompts (e.g., "black", "striped")
+    """
+    try:
+        # Run inference: both towers are precomputed, only the similarity is left
+        with torch.inference_mode():
+            logits_per_image = image_embeds @ text_embeds.T
+            confidences, top_idx = logits_per_image.softmax(dim=1).max(dim=1)
         
-        return results
+        # One device->host copy per tensor instead of two .item() syncs per image
+        return [labels[idx] for idx in top_idx.tolist()], confidences.float().tolist()
         
     except Exception as e:
-        print(f"❌ Batch classification failed: {str(e)}")
-        return [{'label': 'unknown', 'confidence': 0.0} for _ in images]
+        logger.error("❌ Batch classification failed: %s", e)
+        return ['unknown'] * len(image_embeds), [0.0] * len(image_embeds)
 
 
-def extract_category_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_category_batch(image_embeds: torch.Tensor) -> Tuple[List[str], List[float]]:
     """Extract category for multiple images"""
-    text_prompts = [f"a photo of a {category}" for category in CATEGORY_LABELS]
-    results = batch_classify(images, text_prompts, CATEGORY_LABELS)
-    
-    return [{'category': result['label'], 'confidence': result['confidence']} for result in results]
+    return batch_classify(image_embeds, CATEGORY_TEXT_EMBEDS, CATEGORY_LABELS)
 
 
-def extract_color_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_color_batch(image_embeds: torch.Tensor) -> Tuple[List[str], List[float]]:
     """Extract color for multiple images"""
-    text_prompts = [f"{color} clothing" for color in COLOR_LABELS]
-    results = batch_classify(images, text_prompts, COLOR_LABELS)
-    
-    return [{'color': result['label'], 'confidence': result['confidence']} for result in results]
+    return batch_classify(image_embeds, COLOR_TEXT_EMBEDS, COLOR_LABELS)
 
 
-def extract_pattern_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_pattern_batch(image_embeds: torch.Tensor) -> Tuple[List[str], List[float]]:
     """Extract pattern for multiple images"""
-    text_prompts = [f"{pattern} pattern clothing" for pattern in PATTERN_LABELS]
-    results = batch_classify(images, text_prompts, PATTERN_LABELS)
-    
-    return [{'pattern': result['label'], 'confidence': result['confidence']} for result in results]
+    return batch_classify(image_embeds, PATTERN_TEXT_EMBEDS, PATTERN_LABELS)
 
 
-def extract_gender_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_gender_batch(image_embeds: torch.Tensor) -> Tuple[List[str], List[float]]:
     """Extract gender for multiple images"""
-    text_prompts = [f"{gender} clothing" for gender in GENDER_LABELS]
-    results = batch_classify(images, text_prompts, GENDER_LABELS)
-    
-    return [{'gender': result['label'], 'confidence': result['confidence']} for result in results]
+    return batch_classify(image_embeds, GENDER_TEXT_EMBEDS, GENDER_LABELS)
 
 
 def extract_conditional_attribute(
-    images: List[Image.Image],
+    image_embeds: torch.Tensor,
     categories: List[str],
-    attribute_name: str,
     labels: List[str],
-    valid_categories: List[str],
-    prompt_template: str
-) -> List[Optional[Dict[str, Any]]]:
-    """Extract attribute only for images with valid categories"""
+    valid_categories: frozenset,
+    text_embeds: torch.Tensor
+) -> Tuple[List[Optional[str]], List[Optional[float]]]:
+    """Extract attribute only for images with valid categories (None elsewhere)"""
     valid_indices = [i for i, cat in enumerate(categories) if cat in valid_categories]
     
+    full_labels = [None] * len(categories)
+    full_confidences = [None] * len(categories)
+    
+    # Nothing in scope: skip the matmul entirely
     if not valid_indices:
-        return [None] * len(images)
+        return full_labels, full_confidences
     
-    valid_images = [images[i] for i in valid_indices]
-    text_prompts = [prompt_template.format(label=label) for label in labels]
-    results = batch_classify(valid_images, text_prompts, labels)  # Pass labels parameter
+    # Score only the in-scope sub-batch, then scatter back by index
+    sub_embeds = image_embeds.index_select(0, torch.tensor(valid_indices, device=image_embeds.device))
     
-    full_results = [None] * len(images)
-    for idx, result_idx in enumerate(valid_indices):
-        full_results[result_idx] = {
-            attribute_name: results[idx]['label'],
-            'confidence': results[idx]['confidence']
-        }
+    sub_labels, sub_confidences = batch_classify(sub_embeds, text_embeds, labels)
+    
+    for idx, label, confidence in zip(valid_indices, sub_labels, sub_confidences):
+        full_labels[idx] = label
+        full_confidences[idx] = confidence
+    
+    return full_labels, full_confidences
+
+
+def extract_chunk(pixel_values: torch.Tensor, ready_event) -> Tuple[Tuple[list, list], ...]:
+    """
+    Run every attribute extractor on one chunk using the next free model replica
+    Returns (labels, confidences) for category, color, pattern, gender, sleeve, neckline, length
+    """
+    stream, encoder = replicas.get()
     
-    return full_results
+    try:
+        with torch.cuda.stream(stream) if stream is not None else contextlib.nullcontext():
+            if ready_event is not None:
+                stream.wait_event(ready_event)
+                pixel_values.record_stream(stream)
+            
+            # One vision-encoder pass per chunk, shared by every attribute
+            image_embeds = encode_images(pixel_values, encoder)
+            
+            category_columns = extract_category_batch(image_embeds)
+            chunk_categories = category_columns[0]
+            
+            return (
+                category_columns,
+                extract_color_batch(image_embeds),
+                extract_pattern_batch(image_embeds),
+                extract_gender_batch(image_embeds),
+                extract_conditional_attribute(
+                    image_embeds, chunk_categories, SLEEVE_LENGTH_LABELS, SLEEVE_CATEGORIES, SLEEVE_TEXT_EMBEDS
+                ),
+                extract_conditional_attribute(
+                    image_embeds, chunk_categories, NECKLINE_LABELS, NECKLINE_CATEGORIES, NECKLINE_TEXT_EMBEDS
+                ),
+                extract_conditional_attribute(
+                    image_embeds, chunk_categories, LENGTH_LABELS, LENGTH_CATEGORIES, LENGTH_TEXT_EMBEDS
+                ),
+            )
+    finally:
+        replicas.put((stream, encoder))
 
 
 # ============================================================================
 # MAIN HANDLER
 # ============================================================================
 
+# Result keys in extract_chunk column order
+RESULT_ATTRIBUTES = ('category', 'color', 'pattern', 'gender', 'sleeveLength', 'neckline', 'length')
+
+
+def handle_single(image_item: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+    """Single-image fast path: no pipeline thread, decode pool, or batch bookkeeping"""
+    decoded, pixel_values, _ = prepare_chunk([(0, image_item)], None)
+    _, image_id, ok = decoded[0]
+    
+    if not ok:
+        return {"error": "All images failed to decode", "results": []}
+    
+    ready_event = None
+    if device == "cuda":
+        # Staged on this thread's stream; the replica stream waits on it
+        ready_event = torch.cuda.Event()
+        ready_event.record()
+    
+    # CUDA graphs belong to the replica pool threads; any other encoder runs inline without a thread hop
+    if VISION_CUDA_GRAPHS:
+        columns = REPLICA_POOL.submit(extract_chunk, pixel_values, ready_event).result()
+    else:
+        columns = extract_chunk(pixel_values, ready_event)
+    
+    attributes = {}
+    confidence = {}
+    for key, (labels, confidences) in zip(RESULT_ATTRIBUTES, columns):
+        if labels[0] is not None:
+            attributes[key] = labels[0]
+            confidence[key] = confidences[0]
+    
+    processing_time = time.time() - start_time
+    logger.info("single_done processing_time=%.3f", processing_time)
+    
+    return {
+        "results": [{'id': image_id, 'success': True, 'attributes': attributes, 'confidence': confidence}],
+        "stats": {
+            "total": 1,
+            "successful": 1,
+            "failed": 0,
+            "processing_time": processing_time,
+            "images_per_second": 1 / processing_time if processing_time > 0 else 0.0
+        }
+    }
+
+
 def handler(event):
     """
     RunPod handler - processes batch of images
@@ -225,118 +617,136 @@ def handler(event):
         if not image_items:
             return {"error": "No images provided", "results": []}
         
-        print(f"📦 Processing batch of {len(image_items)} images...")
+        if len(image_items) == 1:
+            return handle_single(image_items[0], start_time)
+        
+        logger.debug("📦 Processing batch of %d images...", len(image_items))
         
-        # Decode all images
-        images = []
-        image_ids = []
+        # Decode, upload and extract chunk by chunk so CPU decode overlaps GPU inference
+        # Sized for the whole request up front; trimmed to n_ok after decoding
+        image_ids = [None] * len(image_items)
+        success_indices = [None] * len(image_items)
+        n_ok = 0
         failed_indices = []
         
-        for i, item in enumerate(image_items):
-            image_data = item.get("data")
-            image_id = item.get("id", f"image_{i}")
-            
-            image = decode_image(image_data)
-            
-            if image:
-                images.append(image)
-                image_ids.append(image_id)
-            else:
-                failed_indices.append((i, image_id))
+        categories, category_confs = [], []
+        colors, color_confs = [], []
+        patterns, pattern_confs = [], []
+        genders, gender_confs = [], []
+        sleeves, sleeve_confs = [], []
+        necklines, neckline_confs = [], []
+        lengths, length_confs = [], []
         
-        if not images:
-            return {"error": "All images failed to decode", "results": []}
+        columns = (
+            (categories, category_confs), (colors, color_confs), (patterns, pattern_confs),
+            (genders, gender_confs), (sleeves, sleeve_confs), (necklines, neckline_confs),
+            (lengths, length_confs),
+        )
         
-        print(f"✅ Decoded {len(images)}/{len(image_items)} images successfully")
+        logger.debug("🧠 Extracting attributes in chunks of %d on %d replicas...", PIPELINE_CHUNK_SIZE, VISION_REPLICAS)
         
-        # Extract attributes
-        print("📂 Extracting categories...")
-        category_results = extract_category_batch(images)
-        categories = [r['category'] for r in category_results]
+        # Chunks fan out across replicas; futures are collected in submission (= input) order
+        chunk_futures = []
         
-        print("🎨 Extracting colors and patterns...")
-        color_results = extract_color_batch(images)
-        pattern_results = extract_pattern_batch(images)
+        for decoded, pixel_values, ready_event in iter_prepared_chunks(image_items):
+            for i, image_id, ok in decoded:
+                if ok:
+                    image_ids[n_ok] = image_id
+                    success_indices[n_ok] = i
+                    n_ok += 1
+                else:
+                    failed_indices.append((i, image_id))
+            
+            if pixel_values is not None:
+                chunk_futures.append(REPLICA_POOL.submit(extract_chunk, pixel_values, ready_event))
         
-        print("👤 Extracting gender...")
-        gender_results = extract_gender_batch(images)
+        del image_ids[n_ok:]
+        del success_indices[n_ok:]
         
-        print("👕 Extracting conditional attributes...")
-        sleeve_results = extract_conditional_attribute(
-            images, categories, 'sleeveLength', SLEEVE_LENGTH_LABELS, SLEEVE_CATEGORIES, "{label} sleeve clothing"
-        )
+        for future in chunk_futures:
+            for (labels, confidences), (chunk_labels, chunk_confidences) in zip(columns, future.result()):
+                labels.extend(chunk_labels)
+                confidences.extend(chunk_confidences)
         
-        neckline_results = extract_conditional_attribute(
-            images, categories, 'neckline', NECKLINE_LABELS, NECKLINE_CATEGORIES, "{label} neckline"
-        )
+        if not image_ids:
+            return {"error": "All images failed to decode", "results": []}
         
-        length_results = extract_conditional_attribute(
-            images, categories, 'length', LENGTH_LABELS, LENGTH_CATEGORIES, "{label} length dress"
-        )
+        logger.debug("✅ Decoded and extracted %d/%d images successfully", len(image_ids), len(image_items))
         
-        # Compile results
-        results = []
+        # Compile results straight into input order
+        results = [None] * len(image_items)
         
-        for i in range(len(images)):
+        for (src_idx, image_id, category, color, pattern, gender, sleeve, neckline, length,
+             category_conf, color_conf, pattern_conf, gender_conf, sleeve_conf, neckline_conf, length_conf) in zip(
+                success_indices, image_ids, categories, colors, patterns, genders, sleeves, necklines, lengths,
+                category_confs, color_confs, pattern_confs, gender_confs, sleeve_confs, neckline_confs, length_confs):
             attributes = {
-                'category': category_results[i]['category'],
-                'color': color_results[i]['color'],
-                'pattern': pattern_results[i]['pattern'],
-                'gender': gender_results[i]['gender']  # ✅ NEW: Gender attribute
+                'category': category,
+                'color': color,
+                'pattern': pattern,
+                'gender': gender  # ✅ NEW: Gender attribute
             }
             
             confidence = {
-                'category': category_results[i]['confidence'],
-                'color': color_results[i]['confidence'],
-                'pattern': pattern_results[i]['confidence'],
-                'gender': gender_results[i]['confidence']  # ✅ NEW: Gender confidence
+                'category': category_conf,
+                'color': color_conf,
+                'pattern': pattern_conf,
+                'gender': gender_conf  # ✅ NEW: Gender confidence
             }
             
-            if sleeve_results[i]:
-                attributes['sleeveLength'] = sleeve_results[i]['sleeveLength']
-                confidence['sleeveLength'] = sleeve_results[i]['confidence']
+            if sleeve is not None:
+                attributes['sleeveLength'] = sleeve
+                confidence['sleeveLength'] = sleeve_conf
             
-            if neckline_results[i]:
-                attributes['neckline'] = neckline_results[i]['neckline']
-                confidence['neckline'] = neckline_results[i]['confidence']
+            if neckline is not None:
+                attributes['neckline'] = neckline
+                confidence['neckline'] = neckline_conf
             
-            if length_results[i]:
-                attributes['length'] = length_results[i]['length']
-                confidence['length'] = length_results[i]['confidence']
+            if length is not None:
+                attributes['length'] = length
+                confidence['length'] = length_conf
             
-            results.append({
-                'id': image_ids[i],
+            results[src_idx] = {
+                'id': image_id,
                 'success': True,
                 'attributes': attributes,
                 'confidence': confidence
-            })
+            }
         
         # Add failed images
         for idx, image_id in failed_indices:
-            results.insert(idx, {'id': image_id, 'success': False, 'error': 'Failed to decode image'})
+            results[idx] = {'id': image_id, 'success': False, 'error': 'Failed to decode image'}
         
         processing_time = time.time() - start_time
+        images_per_second = len(image_ids) / processing_time if processing_time > 0 else 0.0
         
-        print(f"✅ Batch completed in {processing_time:.2f}s ({len(images)/processing_time:.1f} images/sec)")
+        stats = {
+            "total": len(image_items),
+            "successful": len(image_ids),
+            "failed": len(failed_indices),
+            "processing_time": processing_time,
+            "images_per_second": images_per_second
+        }
+        
+        # Single structured summary line per request
+        logger.info(
+            "batch_done total=%d successful=%d failed=%d processing_time=%.3f images_per_second=%.1f",
+            stats["total"], stats["successful"], stats["failed"], stats["processing_time"], stats["images_per_second"]
+        )
         
+        # Returned as a dict, not pre-serialized JSON: runpod 1.5.0 has no hook for pre-encoded
+        # bytes, and callers read output.results / output.stats as objects
         return {
             "results": results,
-            "stats": {
-                "total": len(image_items),
-                "successful": len(images),
-                "failed": len(failed_indices),
-                "processing_time": processing_time,
-                "images_per_second": len(images) / processing_time
-            }
+            "stats": stats
         }
         
     except Exception as e:
-        print(f"❌ Handler error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error("❌ Handler error: %s", e, exc_info=DEBUG_TRACEBACKS)
         return {"error": str(e), "results": []}
 
 
 if __name__ == "__main__":
+    warmup()
     print("🚀 Starting RunPod serverless handler...")
     runpod.serverless.start({"handler": handler})
\ No newline at end of file
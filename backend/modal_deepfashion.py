@@ -9,21 +9,28 @@ Updated: January 2025
 
 import modal
 import io
+import os
 import base64
-from typing import Dict, Any, Optional
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 from PIL import Image
 import numpy as np
 
 # Create Modal app
 app = modal.App("deepfashion-attribute-extraction")
 
+# Precomputed prompt embeddings, reused across container boots
+text_emb_volume = modal.Volume.from_name("fashion-clip-text-emb", create_if_missing=True)
+TEXT_EMB_CACHE_DIR = "/cache"
+
 # Define the image with required dependencies and model downloads
 deepfashion_image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install(
         "torch>=2.0.0",
-        "torchvision>=0.15.0",
-        "transformers>=4.30.0",
+        "torchvision>=0.16.0",  # transforms.v2 ToDtype(scale=True)
+        "transformers>=4.45.0",  # SDPA attention for CLIP
         "Pillow>=9.5.0",
         "numpy>=1.24.0",
         "fastapi[standard]>=0.115.0", 
@@ -59,12 +66,55 @@ NECKLINE_LABELS = ['round', 'v-neck', 'collar', 'turtleneck', 'scoop', 'square',
 
 LENGTH_LABELS = ['mini', 'knee', 'midi', 'maxi', 'ankle']
 
+# Categories that have sleeves / necklines / lengths
+SLEEVE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'hoodie', 'jacket', 'coat']
+NECKLINE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater']
+LENGTH_CATEGORIES = ['dress', 'skirt']
+
+# Labels per attribute, in the same order as ATTRIBUTE_PROMPTS
+ATTRIBUTE_LABELS = {
+    'category': CATEGORY_LABELS,
+    'color': COLOR_LABELS,
+    'gender': GENDER_LABELS,
+    'pattern': PATTERN_LABELS,
+    'sleeveLength': SLEEVE_LENGTH_LABELS,
+    'neckline': NECKLINE_LABELS,
+    'length': LENGTH_LABELS,
+}
+
+# Attributes only reported for some categories
+CONDITIONAL_CATEGORIES = {
+    'sleeveLength': SLEEVE_CATEGORIES,
+    'neckline': NECKLINE_CATEGORIES,
+    'length': LENGTH_CATEGORIES,
+}
+
+# Confidence is the softmax over the top-k logits rather than the full label set
+CONFIDENCE_TOP_K = 3
+
+# Vision forwards run in sub-batches of at most MAX_VISION_BATCH, padded up to a warmed bucket
+MAX_VISION_BATCH = 16
+VISION_BATCH_BUCKETS = (1, 4, 8, MAX_VISION_BATCH)
+
+# Zero-shot prompts per attribute, packed in this order into one text table
+ATTRIBUTE_PROMPTS = {
+    'category': [f"a photo of a {category}" for category in CATEGORY_LABELS],
+    'color': [f"{color} clothing" for color in COLOR_LABELS],
+    'gender': [f"{gender} fashion" for gender in GENDER_LABELS],
+    'pattern': [f"{pattern} pattern clothing" for pattern in PATTERN_LABELS],
+    'sleeveLength': [f"{sleeve} sleeve clothing" for sleeve in SLEEVE_LENGTH_LABELS],
+    'neckline': [f"{neckline} neckline" for neckline in NECKLINE_LABELS],
+    'length': [f"{length} length dress" for length in LENGTH_LABELS],
+}
+
 
 @app.cls(
     image=deepfashion_image,
     gpu="T4",
     scaledown_window=300,  # Keep warm for 5 minutes
+    volumes={TEXT_EMB_CACHE_DIR: text_emb_volume},
 )
+@modal.concurrent(max_inputs=16)
 class DeepFashionExtractor:
     """
     DeepFashion attribute extraction using Fashion-CLIP
@@ -74,21 +124,128 @@ class DeepFashionExtractor:
     def load_models(self):
         """Load models when container starts"""
         import torch
+        from torchvision.transforms import v2
         from transformers import CLIPProcessor, CLIPModel
         
         print("🔧 Loading Fashion-CLIP model...")
         
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        # FP16 weights on GPU; similarities and softmax stay in FP32
+        self.dtype = torch.float16 if self.device == "cuda" else torch.float32
+        
         self.processor = CLIPProcessor.from_pretrained("patrickjohncyh/fashion-clip")
-        self.model = CLIPModel.from_pretrained("patrickjohncyh/fashion-clip")
+        self.model = CLIPModel.from_pretrained(
+            "patrickjohncyh/fashion-clip",
+            attn_implementation="sdpa",  # fused scaled_dot_product_attention kernels
+            torch_dtype=self.dtype,
+        )
         self.model.eval()
-        
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model.requires_grad_(False)
         self.model.to(self.device)
+        self.logit_scale = self.model.logit_scale.float().exp()
+        
+        # Same steps as CLIPProcessor's image pipeline, but on batched tensors
+        image_processor = self.processor.image_processor
+        self.image_tf = v2.Compose([
+            v2.Resize(224, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+            v2.CenterCrop(224),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(mean=image_processor.image_mean, std=image_processor.image_std),
+        ])
+        
+        # All vision forwards run on this one thread: reduce-overhead CUDA graphs belong to the
+        # thread that recorded them, and @modal.concurrent inputs must not replay them concurrently
+        self.gpu_executor = ThreadPoolExecutor(max_workers=1)
+        self.compiled = False
+        
+        if self.device == "cuda":
+            self.gpu_executor.submit(self.compile_model).result()
+        
+        # Encode every attribute prompt once; requests only need the vision pass
+        all_prompts = []
+        self.slices = {}
+        for attribute, prompts in ATTRIBUTE_PROMPTS.items():
+            self.slices[attribute] = slice(len(all_prompts), len(all_prompts) + len(prompts))
+            all_prompts.extend(prompts)
+        
+        self.text_emb = self.load_text_embeddings(all_prompts)
+        
+        print(f"✅ Models loaded on {self.device} ({len(all_prompts)} text prompts cached)")
+    
+    def load_text_embeddings(self, prompts: list):
+        """Load the normalized prompt embeddings from the volume, computing them on first use"""
+        import torch
+        import torch.nn.functional as F
+        
+        # Keyed by the prompt list so editing a vocabulary never serves stale embeddings
+        prompts_hash = hashlib.sha256("\n".join(prompts).encode()).hexdigest()[:16]
+        cache_path = f"{TEXT_EMB_CACHE_DIR}/text_emb_{prompts_hash}.pt"
+        
+        if os.path.exists(cache_path):
+            print(f"   📦 Loading cached text embeddings: {cache_path}")
+            try:
+                text_emb = torch.load(cache_path, map_location=self.device, weights_only=True)
+                if text_emb.shape[0] != len(prompts):
+                    raise ValueError(f"expected {len(prompts)} rows, found {text_emb.shape[0]}")
+                return text_emb
+            except Exception as e:
+                # A truncated/incompatible file must not block container boot: recompute and overwrite it
+                print(f"   ⚠️ Cached text embeddings unusable, recomputing: {str(e)}")
+        
+        # padding=True pads to the longest prompt (a few tokens), not CLIP's 77-token context
+        text_inputs = self.processor.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
         
-        print(f"✅ Models loaded on {self.device}")
+        with torch.inference_mode():
+            text_emb = F.normalize(self.model.get_text_features(**text_inputs).float(), p=2, dim=-1)
+        
+        try:
+            torch.save(text_emb.cpu(), cache_path)
+            text_emb_volume.commit()
+        except Exception as e:
+            print(f"   ⚠️ Failed to cache text embeddings: {str(e)}")
+        
+        return text_emb
+    
+    def compile_model(self):
+        """Compile the vision encoder and warm it up, falling back to eager on failure"""
+        import torch
+        
+        eager_get_image_features = self.model.get_image_features
+        eager_similarity = self.similarity
+        
+        try:
+            # Static shapes: one CUDA graph per bucket that encode_chunk pads to
+            self.model.get_image_features = torch.compile(
+                eager_get_image_features, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+            # No CUDA graphs here, so request threads may call it; dynamic covers every batch/slice shape
+            self.similarity = torch.compile(eager_similarity, dynamic=True)
+            
+            # Warm up (twice, so the graphs are recorded) every bucket so requests only replay
+            with torch.inference_mode():
+                for size in VISION_BATCH_BUCKETS:
+                    for _ in range(2):
+                        image_emb = self.model.get_image_features(
+                            pixel_values=torch.zeros(size, 3, 224, 224, device=self.device, dtype=self.dtype)
+                        )[:size].float()
+                # Both request shapes against the full table: [1, D] (size-1 dims are always
+                # specialized) from analyze, and [N, D] from analyze_batch
+                num_prompts = sum(len(prompts) for prompts in ATTRIBUTE_PROMPTS.values())
+                text_emb = torch.zeros(num_prompts, image_emb.shape[-1], device=self.device)
+                self.similarity(image_emb[:1], text_emb)
+                self.similarity(image_emb, text_emb)
+            self.compiled = True
+            print(f"✅ Vision encoder compiled for batch sizes {VISION_BATCH_BUCKETS}")
+        except Exception as e:
+            print(f"⚠️ torch.compile failed, using eager mode: {e}")
+            self.model.get_image_features = eager_get_image_features
+            self.similarity = eager_similarity
     
-    def preprocess_image(self, image_data: str, mime_type: str) -> Image.Image:
-        """Preprocess base64 image data"""
+    def preprocess_image(self, image_data: str, mime_type: str):
+        """Decode base64 image data to a uint8 CHW tensor on CPU"""
+        import torch
+        
         try:
             image_bytes = base64.b64decode(image_data)
             image = Image.open(io.BytesIO(image_bytes))
@@ -96,200 +253,108 @@ class DeepFashionExtractor:
             if image.mode != 'RGB':
                 image = image.convert('RGB')
             
-            return image
+            return torch.from_numpy(np.array(image)).permute(2, 0, 1)
         except Exception as e:
             raise ValueError(f"Failed to preprocess image: {str(e)}")
     
-    def extract_category(self, image: Image.Image) -> Dict[str, Any]:
-        """Extract category using zero-shot classification"""
+    def encode_image(self, image):
+        """Run the vision encoder once and return the image embedding"""
+        return self.encode_images([image])
+    
+    def encode_images(self, images: list):
+        """Run the vision encoder over a list of images in sub-batches, returning embeddings [N, D]"""
         import torch
         
-        text_prompts = [f"a photo of a {category}" for category in CATEGORY_LABELS]
+        # Bounded sub-batches keep bulk requests inside the warmed shapes and T4 memory
+        return torch.cat([
+            self.gpu_executor.submit(self.encode_chunk, images[start:start + MAX_VISION_BATCH]).result()
+            for start in range(0, len(images), MAX_VISION_BATCH)
+        ])
+    
+    def encode_chunk(self, images: list):
+        """Encode up to MAX_VISION_BATCH images on the GPU thread, padded to a warmed bucket"""
+        import torch
         
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
+        n = len(images)
         
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
+        # Resize/crop/normalize run as GPU kernels on the uint8 uploads
+        pixel_values = torch.stack([self.image_tf(image.to(self.device)) for image in images]).to(self.dtype)
         
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
+        bucket = next(size for size in VISION_BATCH_BUCKETS if size >= n) if self.compiled else n
+        if bucket > n:
+            pixel_values = torch.cat([pixel_values, pixel_values.new_zeros(bucket - n, *pixel_values.shape[1:])])
         
-        return {
-            'category': CATEGORY_LABELS[top_idx],
-            'confidence': float(confidence),
-        }
+        with torch.inference_mode():
+            # .float() copies out of the graph's static output buffer before the next replay
+            return self.model.get_image_features(pixel_values=pixel_values)[:n].float()
     
-    def extract_color(self, image: Image.Image) -> Dict[str, Any]:
-        """Extract dominant color"""
-        import torch
+    def similarity(self, image_emb, text_emb):
+        """Scaled cosine-similarity logits; compiled, the normalize is one Inductor kernel and the matmul stays on cuBLAS"""
+        import torch.nn.functional as F
         
-        text_prompts = [f"{color} clothing" for color in COLOR_LABELS]
+        return (F.normalize(image_emb, p=2, dim=-1) @ text_emb.T) * self.logit_scale
+    
+    def score(self, image_emb):
+        """Logits for one image against the full prompt table (one warmed [1, D] similarity call)"""
+        import torch
         
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
+        with torch.inference_mode():
+            return self.similarity(image_emb, self.text_emb)[0]
+    
+    def classify(self, logits, attribute: str, labels: list) -> Dict[str, Any]:
+        """Zero-shot classify from full-table logits, using one attribute's slice"""
+        import torch
         
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
+        with torch.inference_mode():
+            logits = logits[self.slices[attribute]]
+            
+            # Softmax is monotonic: rank on raw logits, normalize only the top-k for confidence
+            top_logits, top_indices = logits.topk(CONFIDENCE_TOP_K)
+            confidence = top_logits.softmax(dim=0)[0].item()
         
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
+        top_idx = top_indices[0].item()
         
         return {
-            'color': COLOR_LABELS[top_idx],
-            'confidence': float(confidence)
+            attribute: labels[top_idx],
+            'confidence': float(confidence),
         }
     
-    def extract_sleeve_length(self, image: Image.Image, category: str) -> Optional[Dict[str, Any]]:
+    def extract_category(self, logits) -> Dict[str, Any]:
+        """Extract category using zero-shot classification"""
+        return self.classify(logits, 'category', CATEGORY_LABELS)
+    
+    def extract_color(self, logits) -> Dict[str, Any]:
+        """Extract dominant color"""
+        return self.classify(logits, 'color', COLOR_LABELS)
+    
+    def extract_sleeve_length(self, logits, category: str) -> Optional[Dict[str, Any]]:
         """Extract sleeve length (only for tops/dresses)"""
-        import torch
-        
-        if category not in ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'hoodie', 'jacket', 'coat']:
+        if category not in SLEEVE_CATEGORIES:
             return None
         
-        text_prompts = [f"{sleeve} sleeve clothing" for sleeve in SLEEVE_LENGTH_LABELS]
-        
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
-        
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
-        
-        return {
-            'sleeveLength': SLEEVE_LENGTH_LABELS[top_idx],
-            'confidence': float(confidence)
-        }
+        return self.classify(logits, 'sleeveLength', SLEEVE_LENGTH_LABELS)
     
-    def extract_gender(self, image: Image.Image) -> Dict[str, Any]:
+    def extract_gender(self, logits) -> Dict[str, Any]:
         """Extract gender/target audience"""
-        import torch
-        
-        text_prompts = [f"{gender} fashion" for gender in GENDER_LABELS]
-        
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
-        
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
-        
-        return {
-            'gender': GENDER_LABELS[top_idx],
-            'confidence': float(confidence)
-        }
+        return self.classify(logits, 'gender', GENDER_LABELS)
     
-    def extract_pattern(self, image: Image.Image) -> Dict[str, Any]:
+    def extract_pattern(self, logits) -> Dict[str, Any]:
         """Extract pattern/print"""
-        import torch
-        
-        text_prompts = [f"{pattern} pattern clothing" for pattern in PATTERN_LABELS]
-        
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
-        
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
-        
-        return {
-            'pattern': PATTERN_LABELS[top_idx],
-            'confidence': float(confidence)
-        }
+        return self.classify(logits, 'pattern', PATTERN_LABELS)
     
-    def extract_neckline(self, image: Image.Image, category: str) -> Optional[Dict[str, Any]]:
+    def extract_neckline(self, logits, category: str) -> Optional[Dict[str, Any]]:
         """Extract neckline type"""
-        import torch
-        
-        if category not in ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater']:
+        if category not in NECKLINE_CATEGORIES:
             return None
         
-        text_prompts = [f"{neckline} neckline" for neckline in NECKLINE_LABELS]
-        
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
-        
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
-        
-        return {
-            'neckline': NECKLINE_LABELS[top_idx],
-            'confidence': float(confidence)
-        }
+        return self.classify(logits, 'neckline', NECKLINE_LABELS)
     
-    def extract_length(self, image: Image.Image, category: str) -> Optional[Dict[str, Any]]:
+    def extract_length(self, logits, category: str) -> Optional[Dict[str, Any]]:
         """Extract garment length"""
-        import torch
-        
-        if category not in ['dress', 'skirt']:
+        if category not in LENGTH_CATEGORIES:
             return None
         
-        text_prompts = [f"{length} length dress" for length in LENGTH_LABELS]
-        
-        inputs = self.processor(
-            text=text_prompts,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)[0]
-        
-        top_idx = probs.argmax().item()
-        confidence = probs[top_idx].item()
-        
-        return {
-            'length': LENGTH_LABELS[top_idx],
-            'confidence': float(confidence)
-        }
+        return self.classify(logits, 'length', LENGTH_LABELS)
     
     @modal.method()
     def analyze(self, image_data: str, mime_type: str = "image/jpeg") -> Dict[str, Any]:
@@ -301,35 +366,39 @@ class DeepFashionExtractor:
         try:
             # Preprocess image
             image = self.preprocess_image(image_data, mime_type)
-            print(f"   ✅ Image preprocessed: {image.size}")
+            print(f"   ✅ Image preprocessed: {tuple(image.shape[1:])}")
+            
+            # Single vision pass shared by every attribute
+            image_emb = self.encode_image(image)
+            logits = self.score(image_emb)
             
             # Extract category first
-            category_result = self.extract_category(image)
+            category_result = self.extract_category(logits)
             category = category_result['category']
             print(f"   📂 Category: {category} (confidence: {category_result['confidence']:.2f})")
             
             # Extract color
-            color_result = self.extract_color(image)
+            color_result = self.extract_color(logits)
             print(f"   🎨 Color: {color_result['color']} (confidence: {color_result['confidence']:.2f})")
             
             # Extract gender
-            gender_result = self.extract_gender(image)
+            gender_result = self.extract_gender(logits)
             print(f"   👤 Gender: {gender_result['gender']} (confidence: {gender_result['confidence']:.2f})")
             
             # Extract pattern
-            pattern_result = self.extract_pattern(image)
+            pattern_result = self.extract_pattern(logits)
             print(f"   🔲 Pattern: {pattern_result['pattern']} (confidence: {pattern_result['confidence']:.2f})")
             
             # Conditional extractions
-            sleeve_result = self.extract_sleeve_length(image, category)
+            sleeve_result = self.extract_sleeve_length(logits, category)
             if sleeve_result:
                 print(f"   👕 Sleeve: {sleeve_result['sleeveLength']} (confidence: {sleeve_result['confidence']:.2f})")
             
-            neckline_result = self.extract_neckline(image, category)
+            neckline_result = self.extract_neckline(logits, category)
             if neckline_result:
                 print(f"   👔 Neckline: {neckline_result['neckline']} (confidence: {neckline_result['confidence']:.2f})")
             
-            length_result = self.extract_length(image, category)
+            length_result = self.extract_length(logits, category)
             if length_result:
                 print(f"   📏 Length: {length_result['length']} (confidence: {length_result['confidence']:.2f})")
             
@@ -367,6 +436,64 @@ class DeepFashionExtractor:
             print(f"   ❌ Error during extraction: {str(e)}")
             raise
 
+    @modal.method()
+    def analyze_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Extract all fashion attributes for a batch of images
+        
+        Each item is {"image": "base64", "mimeType": "image/jpeg"}; results are
+        returned in the same order as {"success": True, "attributes": {...}}
+        or {"success": False, "error": "..."}.
+        """
+        import torch
+        
+        print(f"🎨 Starting batch extraction for {len(items)} images...")
+        
+        results = [None] * len(items)
+        images = []
+        image_indices = []
+        
+        for i, item in enumerate(items):
+            try:
+                images.append(self.preprocess_image(item.get("image"), item.get("mimeType", "image/jpeg")))
+                image_indices.append(i)
+            except ValueError as e:
+                results[i] = {"success": False, "error": str(e)}
+        
+        if images:
+            # One vision pass and one [B, D] @ [D, sum_classes] matmul for every attribute
+            image_emb = self.encode_images(images)
+            
+            with torch.inference_mode():
+                logits = self.similarity(image_emb, self.text_emb)
+                
+                predictions = {}
+                for attribute, labels in ATTRIBUTE_LABELS.items():
+                    top_logits, top_indices = logits[:, self.slices[attribute]].topk(CONFIDENCE_TOP_K, dim=-1)
+                    confidences = top_logits.softmax(dim=-1)[:, 0].tolist()
+                    predictions[attribute] = [
+                        (labels[top_idx], float(confidence))
+                        for top_idx, confidence in zip(top_indices[:, 0].tolist(), confidences)
+                    ]
+            
+            for row, i in enumerate(image_indices):
+                category = predictions['category'][row][0]
+                attributes = {'confidence': {}}
+                
+                for attribute, values in predictions.items():
+                    if attribute in CONDITIONAL_CATEGORIES and category not in CONDITIONAL_CATEGORIES[attribute]:
+                        continue
+                    
+                    label, confidence = values[row]
+                    attributes[attribute] = label
+                    attributes['confidence'][attribute] = confidence
+                
+                results[i] = {"success": True, "attributes": attributes}
+        
+        print(f"   ✅ Extracted attributes for {len(images)}/{len(items)} images")
+        
+        return results
+
 
 # Web endpoint
 @app.function(image=deepfashion_image)
@@ -407,6 +534,43 @@ def analyze_fashion_image(request_data: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+# Batch web endpoint
+@app.function(image=deepfashion_image)
+@modal.web_endpoint(method="POST")
+def analyze_fashion_batch(request_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Web endpoint for batched fashion attribute extraction
+    
+    Request body:
+    {
+        "images": [{"image": "base64_encoded_image", "mimeType": "image/jpeg"}, ...]
+    }
+    """
+    try:
+        items = request_data.get("images", [])
+        
+        if not items:
+            return {
+                "success": False,
+                "error": "No images provided"
+            }
+        
+        # Call the model
+        extractor = DeepFashionExtractor()
+        results = extractor.analyze_batch.remote(items)
+        
+        return {
+            "success": True,
+            "results": results
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
 # Local testing
 @app.local_entrypoint()
 def test():
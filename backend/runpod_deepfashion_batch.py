@@ -18,10 +18,12 @@ Updated: January 2025
 
 import runpod
 import io
+import os
 import base64
 from typing import Dict, Any, List, Optional
 from PIL import Image
 import torch
+import torch.nn.functional as F
 import numpy as np
 from transformers import CLIPProcessor, CLIPModel
 import time
@@ -31,8 +33,14 @@ import time
 # ============================================================================
 
 BATCH_SIZE = 32  # RTX 4090 can handle 32 images efficiently
+
+# Vision forwards are padded up to one of these sizes so the compiled encoder never recompiles
+BATCH_BUCKETS = (1, 8, 16, BATCH_SIZE)
 MODEL_NAME = "patrickjohncyh/fashion-clip"
 
+# Full tracebacks on handler errors only when debugging (expensive under high error rates)
+DEBUG_TRACEBACKS = os.environ.get("DEBUG_TRACEBACKS", "0") == "1"
+
 # Attribute vocabularies
 CATEGORY_LABELS = [
     'dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'hoodie',
@@ -55,6 +63,28 @@ SLEEVE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater', 'h
 NECKLINE_CATEGORIES = ['dress', 'top', 'shirt', 'blouse', 't-shirt', 'sweater']
 LENGTH_CATEGORIES = ['dress', 'skirt']
 
+# Confidence is the softmax over the top-k logits rather than the full label set
+CONFIDENCE_TOP_K = 3
+
+# Zero-shot prompts and labels per attribute
+ATTRIBUTE_PROMPTS = {
+    'category': [f"a photo of a {category}" for category in CATEGORY_LABELS],
+    'color': [f"{color} clothing" for color in COLOR_LABELS],
+    'pattern': [f"{pattern} pattern clothing" for pattern in PATTERN_LABELS],
+    'sleeveLength': [f"{sleeve} sleeve clothing" for sleeve in SLEEVE_LENGTH_LABELS],
+    'neckline': [f"{neckline} neckline" for neckline in NECKLINE_LABELS],
+    'length': [f"{length} length dress" for length in LENGTH_LABELS],
+}
+
+ATTRIBUTE_LABELS = {
+    'category': CATEGORY_LABELS,
+    'color': COLOR_LABELS,
+    'pattern': PATTERN_LABELS,
+    'sleeveLength': SLEEVE_LENGTH_LABELS,
+    'neckline': NECKLINE_LABELS,
+    'length': LENGTH_LABELS,
+}
+
 # ============================================================================
 # GLOBAL MODEL LOADING (happens once per container)
 # ============================================================================
@@ -68,12 +98,28 @@ model = CLIPModel.from_pretrained(MODEL_NAME)
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model.to(device)
 model.eval()
+model.requires_grad_(False)
 
 # Enable optimizations for inference
 if device == "cuda":
     model = model.half()  # Use FP16 for faster inference on RTX 4090
     torch.backends.cudnn.benchmark = True
 
+# Encode every attribute prompt once; requests only run the vision encoder
+all_prompts = [prompt for prompts in ATTRIBUTE_PROMPTS.values() for prompt in prompts]
+# padding=True pads to the longest prompt (a few tokens), not CLIP's 77-token context
+text_inputs = processor(text=all_prompts, return_tensors="pt", padding=True).to(device)
+
+with torch.inference_mode():
+    text_emb = F.normalize(model.get_text_features(**text_inputs).float(), p=2, dim=-1)
+
+TEXT_EMB = dict(zip(ATTRIBUTE_PROMPTS, text_emb.split([len(prompts) for prompts in ATTRIBUTE_PROMPTS.values()])))
+LOGIT_SCALE = model.logit_scale.float().exp()
+
+# Vision tower entry point; swapped for a torch.compile'd version by warmup() on GPU
+vision_encoder = model.get_image_features
+VISION_COMPILED = False
+
 load_time = time.time() - start_time
 print(f"✅ Model loaded on {device} in {load_time:.2f}s")
 print(f"📊 GPU: {torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'CPU'}")
@@ -97,94 +143,117 @@ def decode_image(image_data: str) -> Optional[Image.Image]:
         return None
 
 
-def batch_classify(images: List[Image.Image], text_prompts: List[str]) -> List[Dict[str, Any]]:
+def encode_images_batch(images: List[Image.Image]) -> torch.Tensor:
     """
-    Classify multiple images against text prompts in a single batch
-    Returns list of {label, confidence} for each image
+    Run the vision encoder once over the whole batch
+    Returns L2-normalized image embeddings [N, D] shared by every attribute
     """
+    chunks = []
+    
+    for start in range(0, len(images), BATCH_SIZE):
+        pixel_values = processor(images=images[start:start + BATCH_SIZE], return_tensors="pt").pixel_values.to(device, model.dtype)
+        n = len(pixel_values)
+        
+        # Pad up to a warmed bucket so the compiled graph is reused
+        bucket = next(size for size in BATCH_BUCKETS if size >= n) if VISION_COMPILED else n
+        if bucket > n:
+            pixel_values = torch.cat([pixel_values, pixel_values.new_zeros((bucket - n, *pixel_values.shape[1:]))])
+        
+        with torch.inference_mode():
+            # .float() copies out of the compiled graph's static output before the next replay
+            chunks.append(F.normalize(vision_encoder(pixel_values=pixel_values)[:n].float(), p=2, dim=-1))
+    
+    return torch.cat(chunks)
+
+
+def warmup():
+    """Compile the vision encoder and warm every batch bucket before the first request"""
+    global vision_encoder, VISION_COMPILED
+    
+    if device != "cuda":
+        return
+    
+    warmup_start = time.time()
+    
     try:
-        # Prepare inputs
-        inputs = processor(
-            text=text_prompts,
-            images=images,
-            return_tensors="pt",
-            padding=True
-        ).to(device)
+        vision_encoder = torch.compile(model.get_image_features, mode="max-autotune", dynamic=False)
+        VISION_COMPILED = True
         
-        # Run inference
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits_per_image = outputs.logits_per_image
-            probs = logits_per_image.softmax(dim=1)
+        # First call autotunes + compiles, later calls record and replay the CUDA graph
+        with torch.inference_mode():
+            for size in BATCH_BUCKETS:
+                dummy = torch.zeros((size, 3, 224, 224), device=device, dtype=model.dtype)
+                for _ in range(3):
+                    vision_encoder(pixel_values=dummy)
+        torch.cuda.synchronize()
         
-        # Extract results for each image
-        results = []
-        for i in range(len(images)):
-            top_idx = probs[i].argmax().item()
-            confidence = probs[i][top_idx].item()
+        print(f"✅ Vision encoder compiled for batch sizes {BATCH_BUCKETS} in {time.time() - warmup_start:.2f}s")
+    except Exception as e:
+        print(f"⚠️ torch.compile failed, using eager vision encoder: {str(e)}")
+        vision_encoder = model.get_image_features
+        VISION_COMPILED = False
+
+
+def batch_classify(image_emb: torch.Tensor, attribute: str) -> List[Dict[str, Any]]:
+    """
+    Classify precomputed image embeddings against one attribute's cached text embeddings
+    Returns list of {label, confidence} for each image
+    """
+    try:
+        with torch.inference_mode():
+            logits = image_emb @ TEXT_EMB[attribute].T * LOGIT_SCALE
             
-            results.append({
-                'label': text_prompts[top_idx].split()[-1],
-                'confidence': float(confidence)
-            })
+            # Softmax is monotonic: rank on raw logits, normalize only the top-k for confidence
+            top_logits, top_indices = logits.topk(CONFIDENCE_TOP_K, dim=-1)
+            confidences = top_logits.softmax(dim=-1)[:, 0]
         
-        return results
+        labels = ATTRIBUTE_LABELS[attribute]
+        
+        return [
+            {'label': labels[top_idx], 'confidence': float(confidence)}
+            for top_idx, confidence in zip(top_indices[:, 0].tolist(), confidences.tolist())
+        ]
         
     except Exception as e:
         print(f"❌ Batch classification failed: {str(e)}")
-        return [{'label': 'unknown', 'confidence': 0.0} for _ in images]
+        return [{'label': 'unknown', 'confidence': 0.0} for _ in range(len(image_emb))]
 
 
-def extract_category_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_category_batch(image_emb: torch.Tensor) -> List[Dict[str, Any]]:
     """Extract category for multiple images"""
-    text_prompts = [f"a photo of a {category}" for category in CATEGORY_LABELS]
-    results = batch_classify(images, text_prompts)
+    results = batch_classify(image_emb, 'category')
     
     return [{'category': result['label'], 'confidence': result['confidence']} for result in results]
 
 
-def extract_color_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_color_batch(image_emb: torch.Tensor) -> List[Dict[str, Any]]:
     """Extract color for multiple images"""
-    text_prompts = [f"{color} clothing" for color in COLOR_LABELS]
-    results = batch_classify(images, text_prompts)
+    results = batch_classify(image_emb, 'color')
     
     return [{'color': result['label'], 'confidence': result['confidence']} for result in results]
 
 
-def extract_pattern_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+def extract_pattern_batch(image_emb: torch.Tensor) -> List[Dict[str, Any]]:
     """Extract pattern for multiple images"""
-    text_prompts = [f"{pattern} pattern clothing" for pattern in PATTERN_LABELS]
-    results = batch_classify(images, text_prompts)
+    results = batch_classify(image_emb, 'pattern')
     
     return [{'pattern': result['label'], 'confidence': result['confidence']} for result in results]
 
 
 def extract_conditional_attribute(
-    images: List[Image.Image],
+    image_emb: torch.Tensor,
     categories: List[str],
     attribute_name: str,
-    labels: List[str],
-    valid_categories: List[str],
-    prompt_template: str
+    valid_categories: List[str]
 ) -> List[Optional[Dict[str, Any]]]:
     """Extract attribute only for images with valid categories"""
-    valid_indices = [i for i, cat in enumerate(categories) if cat in valid_categories]
-    
-    if not valid_indices:
-        return [None] * len(images)
+    # Scoring every row against the small label table is cheaper than gathering a sub-batch
+    results = batch_classify(image_emb, attribute_name)
     
-    valid_images = [images[i] for i in valid_indices]
-    text_prompts = [prompt_template.format(label=label) for label in labels]
-    results = batch_classify(valid_images, text_prompts)
-    
-    full_results = [None] * len(images)
-    for idx, result_idx in enumerate(valid_indices):
-        full_results[result_idx] = {
-            attribute_name: results[idx]['label'],
-            'confidence': results[idx]['confidence']
-        }
-    
-    return full_results
+    return [
+        {attribute_name: result['label'], 'confidence': result['confidence']} if category in valid_categories else None
+        for category, result in zip(categories, results)
+    ]
 
 
 # ============================================================================
@@ -232,26 +301,30 @@ def handler(event):
         
         print(f"✅ Decoded {len(images)}/{len(image_items)} images successfully")
         
+        # Single vision pass shared by every attribute
+        print("🧠 Encoding images...")
+        image_emb = encode_images_batch(images)
+        
         # Extract attributes
         print("📂 Extracting categories...")
-        category_results = extract_category_batch(images)
+        category_results = extract_category_batch(image_emb)
         categories = [r['category'] for r in category_results]
         
         print("🎨 Extracting colors and patterns...")
-        color_results = extract_color_batch(images)
-        pattern_results = extract_pattern_batch(images)
+        color_results = extract_color_batch(image_emb)
+        pattern_results = extract_pattern_batch(image_emb)
         
         print("👕 Extracting conditional attributes...")
         sleeve_results = extract_conditional_attribute(
-            images, categories, 'sleeveLength', SLEEVE_LENGTH_LABELS, SLEEVE_CATEGORIES, "{label} sleeve clothing"
+            image_emb, categories, 'sleeveLength', SLEEVE_CATEGORIES
         )
         
         neckline_results = extract_conditional_attribute(
-            images, categories, 'neckline', NECKLINE_LABELS, NECKLINE_CATEGORIES, "{label} neckline"
+            image_emb, categories, 'neckline', NECKLINE_CATEGORIES
         )
         
         length_results = extract_conditional_attribute(
-            images, categories, 'length', LENGTH_LABELS, LENGTH_CATEGORIES, "{label} length dress"
+            image_emb, categories, 'length', LENGTH_CATEGORIES
         )
         
         # Compile results
@@ -294,8 +367,9 @@ def handler(event):
             results.insert(idx, {'id': image_id, 'success': False, 'error': 'Failed to decode image'})
         
         processing_time = time.time() - start_time
+        images_per_second = len(images) / processing_time if processing_time > 0 else 0.0
         
-        print(f"✅ Batch completed in {processing_time:.2f}s ({len(images)/processing_time:.1f} images/sec)")
+        print(f"✅ Batch completed in {processing_time:.2f}s ({images_per_second:.1f} images/sec)")
         
         return {
             "results": results,
@@ -304,17 +378,20 @@ def handler(event):
                 "successful": len(images),
                 "failed": len(failed_indices),
                 "processing_time": processing_time,
-                "images_per_second": len(images) / processing_time
+                "images_per_second": images_per_second
             }
         }
         
     except Exception as e:
         print(f"❌ Handler error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        if DEBUG_TRACEBACKS:
+            import traceback
+            traceback.print_exc()
         return {"error": str(e), "results": []}
 
 
 if __name__ == "__main__":
+    # Warm on the main thread, which also runs the (synchronous) handler
+    warmup()
     print("🚀 Starting RunPod serverless handler...")
     runpod.serverless.start({"handler": handler})
\ No newline at end of file
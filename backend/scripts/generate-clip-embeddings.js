@@ -1,6 +1,7 @@
 // scripts/generate-clip-embeddings.js
 import "dotenv/config";
 import { PrismaClient } from "@prisma/client";
+import { decodeClipEmbeddings } from "../clipEmbeddings.js";
 
 const prisma = new PrismaClient();
 const MODAL_CLIP_BATCH_URL = process.env.MODAL_CLIP_BATCH_URL;
@@ -144,16 +145,17 @@ async function generateEmbeddings() {
 
       const data = await response.json();
 
-      if (!data.success || !data.embeddings) {
+      if (!data.success || !data.embedding_b64) {
         throw new Error("Modal returned invalid response");
       }
 
-      console.log(`   ✅ Got ${data.embeddings.length} embeddings`);
+      const embeddings = decodeClipEmbeddings(data);
+      console.log(`   ✅ Got ${embeddings.length} embeddings`);
 
       // Save to database
       console.log("   💾 Saving to database...");
       for (let j = 0; j < validImages.length; j++) {
-        const embedding = data.embeddings[j];
+        const embedding = embeddings[j];
         const vectorLiteral =
           "[" + embedding.map((x) => x.toFixed(6)).join(",") + "]";
 
@@ -9,6 +9,7 @@ import multer from "multer";
 import fs from "fs/promises";
 import path from "path";
 import { getDynamicSystemPrompt } from "./dynamicPrompt.js";
+import { decodeClipEmbedding } from "./clipEmbeddings.js";
 
 /**
  * ═══════════════════════════════════════════════════════════════════════
@@ -511,7 +512,7 @@ async function getClipImageEmbedding(imageBase64) {
     const data = await response.json();
     console.log("   ✅ CLIP embedding generated, dimensions:", data.dimensions);
 
-    return data.embedding;
+    return decodeClipEmbedding(data);
   } catch (error) {
     console.error("   ❌ CLIP encoding error:", error.message);
     throw error;